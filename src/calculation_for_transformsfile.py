@@ -3,7 +3,8 @@ This script writes the transforms.json
 """
 
 
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import math
@@ -27,19 +28,34 @@ CAMERA_CALIBRATION_FILE = "calibrations/mend_front_back_2side_pinhole.json"
 OUTPUT_DIR = "outputs"
 TEST_NUM = 12
 # CAMERA_TYPE = "pinhole_duplicate0"
+READ_WORKERS = 16 # threads used to read the vehicle_sensor*.json files
+VEHICLE_SENSOR_PREFIX = "vehicle_sensor_"
+
+# This is for the conversion between coordinate systems (aiSim sensor axes -> nerfstudio camera axes).
+# It is the same for every frame, so build it once.
+T_PERMUTATION = np.array([
+    [0, 0, -1],
+    [-1, 0, 0],
+    [0, 1, 0]
+    ])
+
+def load_camera_calibration(camera_calibration_file):
+    """
+    Loads the "camera calibration" profile JSON once, so that the parsed dict can be shared
+    by get_intrinsic_params and get_sensor_position_rotation.
+    """
+    return orjson.loads(Path(camera_calibration_file).read_bytes())
 
-def get_intrinsic_params(camera_calibration_file, camera_type = CAMERA_TYPE):
+def get_intrinsic_params(camera_calibration, camera_type = CAMERA_TYPE):
     """
     Reads nested camera parameters from the "camera calibration" profiles that is found under: C:\aiSim\aiMotive\aisim_gui-5.7.0\data\calibrations folder
 
     Args:
-        input_data (dict): The dictionary loaded from the source JSON file.
+        camera_calibration (dict): The dictionary loaded from the calibration JSON file (see load_camera_calibration).
 
     Returns:
         dict: The restructured camera configuration.
     """
-    with open(camera_calibration_file, 'r') as f:
-        camera_calibration = json.load(f)
     # 1. Navigate to the core camera configuration block
     try:
         camera_config = camera_calibration['sensors'][camera_type]['camera_config']
@@ -81,24 +97,21 @@ def get_intrinsic_params(camera_calibration_file, camera_type = CAMERA_TYPE):
     
     return output
 
-def get_sensor_position_rotation(camera_calibration_file, camera_type = CAMERA_TYPE):
-     with open(camera_calibration_file, 'r') as f:
-        input_data = json.load(f)
+def get_sensor_position_rotation(camera_calibration, camera_type = CAMERA_TYPE):
     # 1. Navigate to the core camera configuration block
-        try:
-            camera_config = input_data['sensors'][CAMERA_TYPE]['camera_config']
-            relative_sensor_position = camera_config['position'] # this is body space position. Is not the absolute position
-            relative_sensor_rotation = camera_config['rotation']
-            
-        except KeyError as e:
-            print(f"Error: Missing expected key in the JSON structure: {e}")
-            return None
+    try:
+        camera_config = camera_calibration['sensors'][camera_type]['camera_config']
+        relative_sensor_position = camera_config['position'] # this is body space position. Is not the absolute position
+        relative_sensor_rotation = camera_config['rotation']
         
-        return relative_sensor_position, relative_sensor_rotation
+    except KeyError as e:
+        print(f"Error: Missing expected key in the JSON structure: {e}")
+        return None
+    
+    return relative_sensor_position, relative_sensor_rotation
 
 def get_rt_transform(file_path):
-    with open(file_path, 'r') as f:
-        vehicle_sensor_data = json.load(f)
+    vehicle_sensor_data = orjson.loads(Path(file_path).read_bytes())
 
     return vehicle_sensor_data["ego_motion"]["rt_transform"]     
 
@@ -114,36 +127,20 @@ def euler_zyx_to_matrix(yaw_rad, pitch_rad, roll_rad):
     # Rz (Rotation around Z-axis)
     # GLM matrix definition is column-major, we transpose to row-major for numpy storage.
     # The GLM code shows the *columns* of the matrix. We use row-major for numpy:
-    # Rz = [[cos_z, sin_z, 0], [-sin_z, cos_z, 0], [0, 0, 1]] (Transposed from GLM column vectors)
-    Rz = np.array([
-        [cos_z, -sin_z, 0.0],
-        [sin_z, cos_z, 0.0],
-        [0.0, 0.0, 1.0]
-    ])
-    
-    # Ry (Rotation around Y-axis)
-    # Ry = [[cos_y, 0, sin_y], [0, 1, 0], [-sin_y, 0, cos_y]] (Transposed from GLM column vectors)
-    Ry = np.array([
-        [cos_y, 0.0, sin_y],
-        [0.0, 1.0, 0.0],
-        [-sin_y, 0.0, cos_y]
-    ])
-
-    # Rx (Rotation around X-axis)
-    # Rx = [[1, 0, 0], [0, cos_x, -sin_x], [0, sin_x, cos_x]] (Transposed from GLM column vectors)
-    Rx = np.array([
-        [1.0, 0.0, 0.0],
-        [0.0, cos_x, -sin_x],
-        [0.0, sin_x, cos_x]
-    ])
+    # Rz = [[cos_z, -sin_z, 0], [sin_z, cos_z, 0], [0, 0, 1]]
+    # Ry = [[cos_y, 0, sin_y], [0, 1, 0], [-sin_y, 0, cos_y]]
+    # Rx = [[1, 0, 0], [0, cos_x, -sin_x], [0, sin_x, cos_x]]
 
     # The final rotation matrix R is calculated as Rz * Ry * Rx
-    # R = Rz @ Ry @ Rx
-    R = Rz @ Ry @ Rx
-    
+    # R = Rz @ Ry @ Rx, written out in closed form so we don't allocate three 3x3 arrays
+    # and do two matmuls just to fill in 9 numbers.
     # Create the 4x4 homogeneous matrix with a 0 translation vector initially
-    M = np.identity(4)
-    M[:3, :3] = R
+    M = np.array([
+        [cos_z * cos_y, cos_z * sin_y * sin_x - sin_z * cos_x, cos_z * sin_y * cos_x + sin_z * sin_x, 0.0],
+        [sin_z * cos_y, sin_z * sin_y * sin_x + cos_z * cos_x, sin_z * sin_y * cos_x - cos_z * sin_x, 0.0],
+        [-sin_y, cos_y * sin_x, cos_y * cos_x, 0.0],
+        [0.0, 0.0, 0.0, 1.0]
+    ])
     
     return M
 
@@ -169,59 +166,81 @@ def calculate_pom_deg(position, yaw_deg, pitch_deg, roll_deg):
     
     return pom
 
-def reshape_rt_transform(rt_transform_array):
-    """
-    Loads the Ego-POM from the 16-element rt_transform array.
-    The documentation implies the array is already structured as the Ego POM.
-    """
-    ego_pom = np.array(rt_transform_array).reshape((4, 4), order='F')
-    return ego_pom
-
-def nerfstudio_conversion(T_matrix):
-    T_converted = np.zeros((4, 4))
-    T_rotation = T_matrix[:3, :3]
-    T_permutation = np.array([ # this is for the conversion between coordinate systems
-        [0, 0, -1],
-        [-1, 0, 0],
-        [0, 1, 0]
-        ])
-    
-    T_rotation_converted = T_rotation @ T_permutation
-    position_vec = T_matrix[:3, 3]
-    position_vec_converted = position_vec# @ T_permutation
-    T_converted[:3, :3] = T_rotation_converted
-    T_converted[:3, 3] = position_vec_converted
-    T_converted[3, 3] = 1.0
-    # print(T_converted)
-    return T_converted
-
-def calculate_ns_transform_matrix(camera_calibration_file, vehicle_sensor_file):
-    """transform matrix like in the nerfstudio transforms.json
-    NOTE: This is the main function that uses all of the functions defined."""
-    # camera_calibration_file = "C:/aiSim/aiMotive/aisim_gui-5.7.0/data/calibrations/mend_front_back_2side_pinhole.json"
-    sensor_pos, sensor_rot = get_sensor_position_rotation(camera_calibration_file)
+def get_sensor_pom(camera_calibration, camera_type = CAMERA_TYPE):
+    """The sensor POM is fixed for the whole run (it is relative to the ego), so compute it once."""
+    sensor_pos, sensor_rot = get_sensor_position_rotation(camera_calibration, camera_type)
     # print(pos, rot)
 
     # are these in degrees
     yaw, pitch, roll = sensor_rot['yaw'], sensor_rot['pitch'], sensor_rot['roll']
-    
-    # 
-    rt_transform_arr = get_rt_transform(vehicle_sensor_file)
-    T_sensor_pom = calculate_pom_deg(sensor_pos, yaw, pitch, roll)
-    T_ego_pom = reshape_rt_transform(rt_transform_arr)
-    # print(f"T_ego_pom = \n {T_ego_pom}")
+    return calculate_pom_deg(sensor_pos, yaw, pitch, roll)
+
+def fold_nerfstudio_conversion(T_sensor_pom, T_permutation = T_PERMUTATION):
+    """
+    Folds the nerfstudio axis permutation into the sensor POM.
+    rot(T_ego @ T_sensor) @ T_perm == rot(T_ego) @ (rot(T_sensor) @ T_perm), and the translation
+    column never sees T_perm, so permuting the sensor rotation once gives the same result as
+    converting every frame afterwards.
+    """
+    T_sensor_pom_ns = T_sensor_pom.copy()
+    T_sensor_pom_ns[:3, :3] = T_sensor_pom[:3, :3] @ T_permutation
+    return T_sensor_pom_ns
+
+def transform_all_frames(rt_transform_arrs, T_sensor_pom_ns):
+    """
+    transform matrix like in the nerfstudio transforms.json, for all frames at once.
+    Each 16-element rt_transform array is the (column-major) Ego POM of its frame.
+    T_sensor_pom_ns is frame-invariant (see fold_nerfstudio_conversion) and should be computed once by the caller.
+    Stacks the N rt_transform arrays into a (N, 4, 4) tensor so we do one broadcasted matmul
+    instead of N small ones (for 4x4 matrices the NumPy call overhead is the actual cost).
+    Returns a (N, 4, 4) array of nerfstudio transform matrices.
+    """
+    n = len(rt_transform_arrs)
+    # transpose(0, 2, 1) does the same as reshape(..., order='F') on each frame
+    T_ego_pom_all = np.asarray(rt_transform_arrs, dtype=np.float64).reshape(n, 4, 4).transpose(0, 2, 1)
     # Doc: When a local coordinate is multiplied by the local POM, the result is a coordinate in the parent space
-    T_sensor_to_world = T_ego_pom @ T_sensor_pom # world, ego, sensor
-    T_sensor_to_world_converted = nerfstudio_conversion(T_sensor_to_world)
+    T_sensor_to_world_all = T_ego_pom_all @ T_sensor_pom_ns # world, ego, sensor
+
+    return T_sensor_to_world_all
 
-    return T_sensor_to_world_converted # T for the ns representation
+def build_frame(colmap_im_id, id_str, T_matrix):
+    """One entry of the transforms.json "frames" list."""
+    frame = {}
+    frame['file_path'] = f"images/{CAMERA_TYPE}_{id_str}.jpg" # supposing that we've converted all .tga images to .jpg
+    frame['mask_path'] = f"masks/mask_{CAMERA_TYPE}_{id_str}.jpg" # mask path
+    frame["transform_matrix"] = T_matrix # ndarray, serialized directly by orjson (OPT_SERIALIZE_NUMPY)
+    frame["colmap_im_id"] = colmap_im_id
+    return frame
+
+def write_transforms_json(output_file_path, intrinsic_params, frames, applied_transform):
+    """
+    Streams the transforms.json to disk: the intrinsics header, then each frame as it comes out of
+    the `frames` iterable, then applied_transform. The full list of frame dicts never exists in memory.
+    The bytes are the same as orjson.dumps({**intrinsic_params, "frames": [...], "applied_transform": ...})
+    with OPT_INDENT_2 (orjson only supports 2-space indentation).
+    """
+    option = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+    with open(output_file_path, 'wb') as f:
+        header = orjson.dumps(intrinsic_params, option=option)
+        f.write(header[:-2]) # drop the closing "\n}"
+        f.write(b',\n  "frames": [')
+        is_empty = True
+        for frame in frames:
+            f.write(b'\n    ' if is_empty else b',\n    ')
+            f.write(orjson.dumps(frame, option=option).replace(b'\n', b'\n    '))
+            is_empty = False
+        f.write(b']' if is_empty else b'\n  ]')
+        f.write(b',\n  "applied_transform": ')
+        f.write(orjson.dumps(applied_transform, option=option).replace(b'\n', b'\n  '))
+        f.write(b'\n}')
 
 # TEST - for a single example
 # def main():
 #     print(TEST_NUM)
 #     camera_calibration_file = "C:/aiSim/aiMotive/aisim_gui-5.7.0/data/calibrations/mend_front_back_2side_pinhole.json" # the calibration file
 #     vehicle_sensor_file = "./data/2025-12-04_18-22-25/ego/vehicle_sensor/vehicle_sensor_00000.json" # single example file
-#     print(calculate_ns_transform_matrix(camera_calibration_file, vehicle_sensor_file))
+#     T_sensor_pom_ns = fold_nerfstudio_conversion(get_sensor_pom(load_camera_calibration(camera_calibration_file)))
+#     print(transform_all_frames([get_rt_transform(vehicle_sensor_file)], T_sensor_pom_ns)[0])
 
 #The Main loop
 def main():
@@ -230,33 +249,29 @@ def main():
     output_file_path = output_dir / f"transforms_{CAMERA_TYPE}_test{TEST_NUM}.json"
     print(f"[INFO] Output path is {str(output_file_path)}")
     
-    intrinsic_params = get_intrinsic_params(CAMERA_CALIBRATION_FILE, CAMERA_TYPE)
+    camera_calibration = load_camera_calibration(CAMERA_CALIBRATION_FILE)
+    intrinsic_params = get_intrinsic_params(camera_calibration, CAMERA_TYPE)
+    # write_transforms_json splices the frames into this dict's serialized form, so a missing
+    # (None) or empty one would silently produce a broken transforms.json
+    if not isinstance(intrinsic_params, dict) or not intrinsic_params:
+        raise ValueError(f"No intrinsic parameters for {CAMERA_TYPE} in {CAMERA_CALIBRATION_FILE}")
+    T_sensor_pom_ns = fold_nerfstudio_conversion(get_sensor_pom(camera_calibration, CAMERA_TYPE))
 
     vehicle_sensor_files_path = Path("./data/2025-12-04_18-22-25/ego/vehicle_sensor") # for the whole car
-    vehicle_sensor_files = list(vehicle_sensor_files_path.glob("vehicle_sensor*.json"))
+    # The glob pattern guarantees the prefix, so the frame id is simply the rest of the stem
+    vehicle_sensor_files = sorted(vehicle_sensor_files_path.glob(f"{VEHICLE_SENSOR_PREFIX}*.json"))
+    id_strs = [vehicle_sensor_file.stem[len(VEHICLE_SENSOR_PREFIX):] for vehicle_sensor_file in vehicle_sensor_files]
     # vehicle_sensor_files = vehicle_sensor_files[:1]
     print(f"[INFO] We've got {len(vehicle_sensor_files)} files found for vehicle_sensor*.json")
-    frames = []
-
-    for vehicle_sensor_file in tqdm(vehicle_sensor_files):
-        stem = vehicle_sensor_file.stem # filename without extension
-        prefix = "vehicle_sensor_"
-        if stem.startswith(prefix):
-            id_str = stem.replace(prefix, "")
-        else:
-            id_str = "N/A"
-
-        T_matrix = calculate_ns_transform_matrix(CAMERA_CALIBRATION_FILE, vehicle_sensor_file)
-        frame = {}
-        frame['file_path'] = f"images/{CAMERA_TYPE}_{id_str}.jpg" # supposing that we've converted all .tga images to .jpg
-        frame['mask_path'] = f"masks/mask_{CAMERA_TYPE}_{id_str}.jpg" # mask path
-        frame["transform_matrix"] = T_matrix.tolist()
-        frame["colmap_im_id"] = int(id_str)
-        frames.append(frame)
-
-    transforms = intrinsic_params
-    transforms["frames"] = frames
-    transforms["applied_transform"] = [
+    # Reading the per-frame json files is I/O bound, so overlap the reads in a thread pool
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        rt_transform_arrs = list(tqdm(executor.map(get_rt_transform, vehicle_sensor_files), total=len(vehicle_sensor_files)))
+    T_matrices = transform_all_frames(rt_transform_arrs, T_sensor_pom_ns)
+    # The zero-padded ids sort the same as numbers, so the position in the sorted list is the colmap id
+    # (equal to int(id_str) for a gap-free dump). id_str is still used for the paths so they always match the files.
+    frames = (build_frame(i, id_str, T_matrix) for i, (id_str, T_matrix) in enumerate(zip(id_strs, T_matrices)))
+
+    applied_transform = [
         [
             1.0,
             0.0,
@@ -277,8 +292,7 @@ def main():
         ]
     ]
     
-    with open(output_file_path, 'w') as f:
-        json.dump(transforms, f, indent=4)
+    write_transforms_json(output_file_path, intrinsic_params, frames, applied_transform)
     print("Done!")
 
 
@@ -1,9 +1,22 @@
 import open3d as o3d
 import numpy as np
-import json
+import orjson
+import hashlib
+import io
 import cv2
 import os
+import time
+import tempfile
+from itertools import repeat
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from downsample_ply import write_ply
+
+try:
+    from numba import njit, prange
+except ImportError: # Numba is optional, find_last_visible falls back to the batched NumPy projection
+    njit = None
 
 # --- CONFIGURATION ---
 DATASET_FOLDER = Path('aisim_ns_dataset_lidar')
@@ -11,55 +24,307 @@ PLY_FILE = DATASET_FOLDER / "lidar_world_aligned.ply"  # The uncolored point clo
 JSON_FILE = DATASET_FOLDER / "transforms.json"         # Nerfstudio transforms
 IMAGE_DIR = DATASET_FOLDER                # Root dir where image paths in JSON are relative to
 OUTPUT_FILE = DATASET_FOLDER / "lidar_colored.ply"
+CACHE_DIR = DATASET_FOLDER / ".cache"                 # Camera matrices from earlier runs, keyed by the JSON hash
 
 # Optimization: Don't use every single frame (too slow). 
 # Using every 10th frame is usually enough to color the whole map.
 FRAME_STEP = 10 
+# Points are projected into all sampled frames at once, in chunks of about this many (frame, point) pairs.
+# Caps the scratch memory of the batched projection (~100 bytes per pair).
+PROJECTION_CHUNK = 4_000_000
+# Threads for reading/sampling the images (cv2.imread and NumPy release the GIL)
+IO_WORKERS = 8
+# Image decoder: "cv2", "pillow" (decodes straight to RGB, fastest with Pillow-SIMD)
+# or "auto" to time both on the first image and keep the faster one
+IMAGE_DECODER = "auto"
 # ---------------------
 
 def load_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
+    """Returns the parsed JSON and a short hash of its bytes (used as cache key)."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return orjson.loads(raw), hashlib.sha1(raw).hexdigest()[:16]
 
-def get_camera_matrix(json_data, frame_idx):
+def get_camera_matrices(json_data, frame_indices):
     """
-    Returns the World-to-Camera matrix (Inverse of pose).
+    Returns the World-to-Camera matrices (Inverse of pose) of the given frames, (F, 4, 4).
     Also handles coordinate conversion from OpenGL (Nerfstudio) to OpenCV.
     """
-    frame = json_data['frames'][frame_idx]
-    c2w = np.array(frame['transform_matrix']) # Camera to World
-    
+    frames = json_data['frames']
+    # Convert all the poses into one (F, 4, 4) array up front
+    c2w_all = np.array([frames[i]['transform_matrix'] for i in frame_indices], dtype=np.float64)
     # 1. Invert to get World to Camera
-    w2c = np.linalg.inv(c2w)
-    
+    w2c_all = np.linalg.inv(c2w_all)
+
     # 2. Nerfstudio is OpenGL convention (-Z forward, +Y Up).
-    #    OpenCV projection needs +Z forward, +Y Down.
-    #    We need to flip Y and Z axes.
-    #    Correction Matrix: 1, 0, 0; 0, -1, 0; 0, 0, -1
-    fix_rot = np.array([
-        [1, 0, 0, 0],
-        [0, -1, 0, 0],
-        [0, 0, -1, 0],
-        [0, 0, 0, 1]
-    ])
-    
-    # Apply correction: New_W2C = Fix @ Old_W2C
-    w2c_cv = fix_rot @ w2c
-    return w2c_cv
+    # OpenCV projection needs +Z forward, +Y Down, so flip the Y and Z axes:
+    # diag(1, -1, -1, 1) @ w2c, which just flips the sign of the Y and Z rows
+    w2c_all[:, 1:3] *= -1
+    return w2c_all
+
+def load_camera_matrices(json_data, digest):
+    """
+    Returns the [R|t] World-to-Camera matrices of ALL frames, (F, 3, 4).
+    They are saved to CACHE_DIR the first time, so later runs on the same
+    transforms.json (e.g. with another FRAME_STEP) skip the inversion.
+    """
+    cache_path = CACHE_DIR / f"w2c_{digest}.npy"
+    if cache_path.exists():
+        return np.load(cache_path, mmap_mode='r')
+
+    # The last row is always [0, 0, 0, 1], no need to keep it
+    w2c_all = get_camera_matrices(json_data, range(len(json_data['frames'])))[:, :3, :]
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Write to a temp file and rename it into place, so a run killed mid-write
+    # can't leave a truncated .npy behind for the next run to choke on
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, w2c_all)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return w2c_all
+
+# cv2.remap only takes maps smaller than SHRT_MAX (32767) in each dimension,
+# so the samples are laid out as an image of REMAP_WIDTH columns and remapped in blocks of rows.
+REMAP_WIDTH = 1024
+REMAP_MAX_ROWS = 32000
+
+def decode_image_bytes(raw, decoder):
+    """
+    Decodes one encoded image with the given decoder. Returns (img, is_bgr), img is None
+    if the bytes can't be decoded.
+    """
+    if decoder == "pillow":
+        try:
+            with Image.open(io.BytesIO(raw)) as pil_img:
+                if pil_img.mode != "RGB":
+                    pil_img = pil_img.convert("RGB")
+                return np.asarray(pil_img), False
+        except OSError:
+            return None, False
+    # OpenCV decodes to BGR
+    return cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR), True
+
+def read_image(img_path, decoder):
+    """
+    Reads and decodes one image. Goes through decode_image_bytes like the benchmark
+    in pick_image_decoder, so the decoder it picks is the code that runs.
+    """
+    try:
+        raw = Path(img_path).read_bytes()
+    except OSError:
+        return None, decoder != "pillow"
+    return decode_image_bytes(raw, decoder)
+
+def pick_image_decoder(img_path, runs=3):
+    """
+    Decodes img_path with both decoders and returns the name of the faster one.
+    Both decode the same in-memory bytes (so neither pays for the cold disk read)
+    and the best of a few runs is kept, one run is too noisy.
+    """
+    raw = Path(img_path).read_bytes()
+    timings = {}
+    for decoder in ("cv2", "pillow"):
+        best = float("inf")
+        for _ in range(runs):
+            start = time.perf_counter()
+            img, _ = decode_image_bytes(raw, decoder)
+            if img is None:
+                break
+            best = min(best, time.perf_counter() - start)
+        timings[decoder] = best
+    return min(timings, key=timings.get)
+
+def sample_image_colors(img_path, u, v, decoder="cv2", size=None):
+    """
+    Reads one image and returns the RGB colors (0-255) at the sub-pixel coordinates (u, v),
+    bilinearly interpolated with cv2.remap, or None if the image can't be read.
+    (u, v) were bounds-checked against size = (w, h) from the transforms.json, so an image
+    of another size is skipped (None) rather than sampled at clamped coordinates.
+    """
+    # A BGR image is sampled as is and the (much smaller) result is flipped to RGB at the end
+    img, is_bgr = read_image(img_path, decoder)
+    if img is None:
+        return None
+    if size is not None and img.shape[1::-1] != tuple(size):
+        print(f"[Warning] {img_path} is {img.shape[1]}x{img.shape[0]}, transforms.json says {size[0]}x{size[1]}. Skipping.")
+        return None
+
+    n = len(u)
+    rows = -(-n // REMAP_WIDTH)
+    map_x = np.zeros((rows, REMAP_WIDTH), dtype=np.float32)
+    map_y = np.zeros((rows, REMAP_WIDTH), dtype=np.float32)
+    map_x.flat[:n] = u
+    map_y.flat[:n] = v
+
+    sampled = np.empty((rows, REMAP_WIDTH, 3), dtype=np.uint8)
+    for r in range(0, rows, REMAP_MAX_ROWS):
+        sampled[r:r + REMAP_MAX_ROWS] = cv2.remap(
+            img, map_x[r:r + REMAP_MAX_ROWS], map_y[r:r + REMAP_MAX_ROWS],
+            interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+        )
+
+    sampled = sampled.reshape(-1, 3)[:n]
+    # BGR -> RGB
+    return sampled[:, ::-1] if is_bgr else sampled
+
+def find_last_visible_numpy(points, R_all, t_all, fl_x, fl_y, cx, cy, w, h):
+    """
+    For every point, finds the last frame (index into R_all/t_all) that has it in front of the camera and
+    inside the image, and its pixel coordinates there. best_frame is -1 for points no frame sees.
+    Projects chunks of points into all frames at once with NumPy.
+    """
+    num_frames = R_all.shape[0]
+    num_points = points.shape[0]
+    best_frame = np.full(num_points, -1, dtype=np.int64)
+    best_u = np.empty(num_points)
+    best_v = np.empty(num_points)
+    chunk_size = max(1, PROJECTION_CHUNK // num_frames)
+    # Scratch buffer for the camera space coords, allocated once and reused by every chunk
+    pts_cam_buffer = np.empty(num_frames * min(chunk_size, num_points) * 3, dtype=np.result_type(points, R_all))
+
+    for start in range(0, num_points, chunk_size):
+        chunk = points[start:start + chunk_size]
+        n = chunk.shape[0]
+
+        # (F, 3, 3) x (n, 3) + (F, 1, 3) -> (F, n, 3): Camera space coords of the chunk in every frame
+        pts_cam = pts_cam_buffer[:num_frames * n * 3].reshape(num_frames, n, 3)
+        np.einsum('fij,nj->fni', R_all, chunk, out=pts_cam)
+        np.add(pts_cam, t_all[:, None, :], out=pts_cam)
+
+        # Filter: Keep only points In Front of camera (Z > 0.1) first,
+        # so the perspective divide and the bounds checks only run on that subset
+        front = pts_cam[..., 2] > 0.1
+        pts_front = pts_cam[front]
+
+        # Perspective Divide + intrinsics: u = fx * (x/z) + cx
+        u = (pts_front[:, 0] * fl_x / pts_front[:, 2]) + cx
+        v = (pts_front[:, 1] * fl_y / pts_front[:, 2]) + cy
+
+        # Inside the image bounds, scattered back to a (F, n) visibility mask
+        visible = np.zeros((num_frames, n), dtype=bool)
+        visible[front] = (u >= 0) & (u < w - 1) & (v >= 0) & (v < h - 1)
+
+        seen = np.flatnonzero(visible.any(axis=0))
+        last_frame = num_frames - 1 - np.argmax(visible[::-1, seen], axis=0)
+
+        # Redo the divide for just the winning (frame, point) pairs, the same arithmetic as above
+        pts_best = pts_cam[last_frame, seen]
+        best_frame[start + seen] = last_frame
+        best_u[start + seen] = (pts_best[:, 0] * fl_x / pts_best[:, 2]) + cx
+        best_v[start + seen] = (pts_best[:, 1] * fl_y / pts_best[:, 2]) + cy
+
+    return best_frame, best_u, best_v
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _find_last_visible_kernel(points, R_all, t_all, fl_x, fl_y, cx, cy, w, h, best_frame, best_u, best_v):
+        # One fused pass per point: project, mask and pick the frame without any (F, n) temporaries
+        num_frames = R_all.shape[0]
+        for n in prange(points.shape[0]):
+            px, py, pz = points[n, 0], points[n, 1], points[n, 2]
+
+            # Walk the frames backwards, the first hit is the last frame that sees the point
+            for f in range(num_frames - 1, -1, -1):
+                z = R_all[f, 2, 0] * px + R_all[f, 2, 1] * py + R_all[f, 2, 2] * pz + t_all[f, 2]
+                if z <= 0.1:
+                    continue
+                x = R_all[f, 0, 0] * px + R_all[f, 0, 1] * py + R_all[f, 0, 2] * pz + t_all[f, 0]
+                u = (x * fl_x / z) + cx
+                if u < 0 or u >= w - 1:
+                    continue
+                y = R_all[f, 1, 0] * px + R_all[f, 1, 1] * py + R_all[f, 1, 2] * pz + t_all[f, 1]
+                v = (y * fl_y / z) + cy
+                if v < 0 or v >= h - 1:
+                    continue
+
+                best_frame[n] = f
+                best_u[n] = u
+                best_v[n] = v
+                break
+
+def find_last_visible(points, R_all, t_all, fl_x, fl_y, cx, cy, w, h):
+    """Same as find_last_visible_numpy, using the Numba kernel when Numba is installed."""
+    if njit is None:
+        return find_last_visible_numpy(points, R_all, t_all, fl_x, fl_y, cx, cy, w, h)
+
+    num_points = points.shape[0]
+    best_frame = np.full(num_points, -1, dtype=np.int64)
+    best_u = np.empty(num_points)
+    best_v = np.empty(num_points)
+    # Intrinsics in the same precision as the points, so a float32 cloud is projected in float32
+    scalar = np.result_type(points, R_all).type
+    _find_last_visible_kernel(
+        np.ascontiguousarray(points), np.ascontiguousarray(R_all), np.ascontiguousarray(t_all),
+        scalar(fl_x), scalar(fl_y), scalar(cx), scalar(cy), scalar(w), scalar(h),
+        best_frame, best_u, best_v
+    )
+    return best_frame, best_u, best_v
+
+def color_points(points, point_ids, colors, R_all, t_all, intrinsics, img_paths, frame_ids, total_frames, decoder):
+    """
+    Colors points[point_ids] (all points if point_ids is None) from the last of the given frames that sees them,
+    writing into colors. R_all/t_all/img_paths/frame_ids describe the frames, frame_ids are only for the progress print.
+    Returns the positions of the frames whose image couldn't be used, and the ids of the points left uncolored by them.
+    """
+    num_frames = len(img_paths)
+    pts = points if point_ids is None else points[point_ids]
+
+    # 1. Project the points into all the frames.
+    # Later frames overwrite earlier ones, so for every point we only keep the LAST frame that sees it
+    # and where it lands in that image. Then each image only has to be sampled once.
+    best_frame, best_u, best_v = find_last_visible(pts, R_all, t_all, *intrinsics)
+
+    # 2. Sample Colors: group the points by their frame, read every image once
+    order = np.argsort(best_frame, kind='stable')
+    bounds = np.searchsorted(best_frame[order], np.arange(num_frames + 1))
+
+    point_idx_per_frame = [order[bounds[f]:bounds[f + 1]] for f in range(num_frames)]
+    jobs = [f for f in range(num_frames) if len(point_idx_per_frame[f]) > 0]
+
+    failed = []
+    leftover = []
+    # Decode + sample the images in a thread pool, but scatter into `colors` here on the main thread.
+    # Every point belongs to exactly one frame, so the order of the writes doesn't matter.
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+        results = executor.map(
+            sample_image_colors,
+            [img_paths[f] for f in jobs],
+            [best_u[point_idx_per_frame[f]] for f in jobs],
+            [best_v[point_idx_per_frame[f]] for f in jobs],
+            repeat(decoder),
+            repeat(intrinsics[4:]),
+        )
+
+        for n, (f, new_colors) in enumerate(zip(jobs, results)):
+            idx = point_idx_per_frame[f]
+            ids = idx if point_ids is None else point_ids[idx]
+            if new_colors is None:
+                failed.append(f)
+                leftover.append(ids)
+                continue
+
+            colors[ids] = new_colors
+
+            if n % 10 == 0:
+                print(f"Processed frame {frame_ids[f]}/{total_frames}...")
+
+    return failed, (np.concatenate(leftover) if leftover else np.empty(0, dtype=np.int64))
 
 def main():
     print(f"Loading Point Cloud {PLY_FILE}...")
     pcd = o3d.io.read_point_cloud(PLY_FILE)
-    points = np.asarray(pcd.points)
+    # float32 is plenty for projecting into the images and halves the memory traffic
+    points = np.asarray(pcd.points, dtype=np.float32)
     
-    # Initialize colors to Grey (0.5)
-    colors = np.full(points.shape, 0.5)
-    
-    # Add a column of 1s for matrix multiplication (N, 4)
-    points_hom = np.hstack((points, np.ones((points.shape[0], 1))))
+    # Initialize colors to Grey (128), kept as uint8 since that's what the PLY stores anyway
+    colors = np.full(points.shape, 128, dtype=np.uint8)
     
     print(f"Loading JSON {JSON_FILE}...")
-    meta = load_json(JSON_FILE)
+    meta, digest = load_json(JSON_FILE)
     
     # Get global intrinsics (assuming all cams are same)
     fl_x = meta.get('fl_x')
@@ -70,73 +335,44 @@ def main():
     h = meta.get('h')
     
     frames = meta['frames']
-    print(f"Projecting colors from {len(frames):,} frames (Step={FRAME_STEP})...")
-    
-    for i in range(0, len(frames), FRAME_STEP):
-        frame = frames[i]
-        
-        # 1. Load Image
-        img_path = os.path.join(IMAGE_DIR, frame['file_path'])
-        if not os.path.exists(img_path):
-            continue
-            
-        # Read image (OpenCV reads as BGR, convert to RGB)
-        img = cv2.imread(img_path)
-        if img is None: continue
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img_h, img_w, _ = img.shape
-        
-        # 2. Project Points
-        # Convert World Points -> Camera Space
-        w2c = get_camera_matrix(meta, i)
-        
-        # Matrix Multiply: (4x4 @ 4xN).T -> Nx4
-        # We process ALL 5 million points at once using vector math (fast!)
-        pts_cam = (w2c @ points_hom.T).T
-        
-        # Extract X, Y, Z
-        xyz = pts_cam[:, :3]
-        Z = xyz[:, 2]
-        
-        # 3. Filter: Keep only points In Front of camera (Z > 0)
-        # We use a small epsilon 0.1 to avoid division by zero
-        valid_z_mask = Z > 0.1
-        
-        # 4. Perspective Divide (X/Z, Y/Z)
-        # Apply intrinsics: u = fx * (x/z) + cx
-        u = (xyz[:, 0] * fl_x / Z) + cx
-        v = (xyz[:, 1] * fl_y / Z) + cy
-        
-        # 5. Filter: Keep only points inside image bounds
-        valid_u = (u >= 0) & (u < img_w - 1)
-        valid_v = (v >= 0) & (v < img_h - 1)
-        
-        # Combine masks
-        final_mask = valid_z_mask & valid_u & valid_v
-        
-        if np.count_nonzero(final_mask) == 0:
-            continue
-            
-        # 6. Sample Colors
-        # Get integer indices
-        u_idx = u[final_mask].astype(int)
-        v_idx = v[final_mask].astype(int)
-        
-        # Read colors from image array [row, col] -> [v, u]
-        new_colors = img[v_idx, u_idx]
-        
-        # Normalize 0-255 -> 0.0-1.0
-        new_colors = new_colors.astype(float) / 255.0
-        
-        # Update the global color array
-        colors[final_mask] = new_colors
-        
-        if i % 100 == 0:
-            print(f"Processed frame {i}/{len(frames)}...")
+    # Only frames that have an image on disk take part
+    frame_indices = [
+        i for i in range(0, len(frames), FRAME_STEP)
+        if os.path.exists(os.path.join(IMAGE_DIR, frames[i]['file_path']))
+    ]
+    num_frames = len(frame_indices)
+    print(f"Projecting colors from {num_frames:,} of {len(frames):,} frames (Step={FRAME_STEP})...")
+
+    if num_frames > 0:
+        # World -> Camera matrices of all sampled frames, (F, 3, 4)
+        # split into the rotation (F, 3, 3) and translation (F, 3)
+        w2c_all = load_camera_matrices(meta, digest)[frame_indices]
+        R_all = w2c_all[:, :, :3].astype(np.float32)
+        t_all = w2c_all[:, :, 3].astype(np.float32)
+        intrinsics = (fl_x, fl_y, cx, cy, w, h)
+        img_paths = [os.path.join(IMAGE_DIR, frames[i]['file_path']) for i in frame_indices]
+
+        decoder = IMAGE_DECODER
+        if decoder == "auto":
+            decoder = pick_image_decoder(img_paths[0])
+        print(f"Decoding images with {decoder}")
+
+        # Like painting frame after frame and skipping unreadable images: points whose frame failed
+        # get colored again from the remaining frames (an earlier one that sees them), else stay grey
+        usable = np.arange(num_frames)
+        point_ids = None
+        while len(usable) > 0:
+            failed, point_ids = color_points(
+                points, point_ids, colors, R_all[usable], t_all[usable], intrinsics,
+                [img_paths[f] for f in usable], [frame_indices[f] for f in usable], len(frames), decoder
+            )
+            if not failed:
+                break
+            usable = np.delete(usable, failed)
+            print(f"[Warning] Couldn't use {len(failed)} images, recoloring their {len(point_ids):,} points from the other frames")
 
     print("Saving colored point cloud...")
-    pcd.colors = o3d.utility.Vector3dVector(colors)
-    o3d.io.write_point_cloud(OUTPUT_FILE, pcd, write_ascii=False)
+    write_ply(OUTPUT_FILE, points, colors)
     print("Done! Open in CloudCompare to verify.")
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 """This file is to join 4 camera_type's transforms.json output into a single json file"""
 
-import json
+import orjson
 from pathlib import Path
 
 INPUT_DIR = "transforms_outputs"
@@ -34,8 +34,8 @@ print(f"Merging {len(input_files)} files with step size {FRAME_STEP}...")
 
 for index, file_path in enumerate(input_files):
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
             
             # Get the raw frames from the file
             raw_frames = data.get('frames', [])
@@ -58,15 +58,12 @@ for index, file_path in enumerate(input_files):
         print(f"Error: Could not find file {file_path}")
 
 # Assign the combined list back to the master dictionary
-master_data['frames'] = combined_frames
-
 # IMPORTANT: Re-index IDs to ensure they are unique and sequential
 # Since we skipped frames, the original IDs might have gaps.
-for i, frame in enumerate(master_data['frames']):
-    frame['colmap_im_id'] = i
+master_data['frames'] = [{**frame, 'colmap_im_id': i} for i, frame in enumerate(combined_frames)]
 
-# Save to new file
-with open(output_file, 'w') as f:
-    json.dump(master_data, f, indent=4)
+# Save to new file (orjson only does 2-space indentation)
+with open(output_file, 'wb') as f:
+    f.write(orjson.dumps(master_data, option=orjson.OPT_INDENT_2))
 
 print(f"Success! Saved {len(master_data['frames'])} total frames to {output_file}")
\ No newline at end of file
@@ -1,4 +1,5 @@
 import open3d as o3d
+import numpy as np
 import os
 
 # --- CONFIG ---
@@ -7,6 +8,61 @@ OUTPUT_FILE = "aisim_ns_dataset_lidar/lidar_optimized.ply"
 VOXEL_SIZE = 0.1  # 0.1 means 10cm. Increase to 0.2 or 0.3 if file is still too big.
 # --------------
 
+def voxel_downsample(points, voxel_size, colors=None):
+    """
+    Averages all points (and colors) that fall into the same voxel.
+    Same grid as Open3D's voxel_down_sample, done with NumPy instead.
+    Returns (points, colors), colors is None if none were given.
+    """
+    if len(points) == 0:
+        # Like Open3D, an empty cloud just stays empty (min() has nothing to work on)
+        return np.empty((0, 3)), (np.empty((0, 3)) if colors is not None else None)
+
+    min_bound = points.min(axis=0) - voxel_size * 0.5
+    voxels = np.floor((points - min_bound) / voxel_size).astype(np.int64)
+
+    # Pack the 3 voxel indices into one int64 key (21 bits each) so np.unique
+    # only has to sort a flat array. Fall back to row-wise unique if too big.
+    if voxels.max() < (1 << 21):
+        keys = voxels[:, 0] | (voxels[:, 1] << 21) | (voxels[:, 2] << 42)
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    else:
+        _, inverse, counts = np.unique(voxels, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    def voxel_mean(values):
+        sums = [np.bincount(inverse, weights=values[:, i], minlength=len(counts)) for i in range(3)]
+        return np.stack(sums, axis=1) / counts[:, None]
+
+    return voxel_mean(points), (voxel_mean(colors) if colors is not None else None)
+
+def write_ply(path, points, colors=None):
+    """
+    Writes a binary little-endian PLY (float32 xyz, optional uint8 rgb) straight
+    from NumPy, without building an Open3D PointCloud first.
+    Float colors are expected in [0, 1], uint8 colors are written as they are.
+    """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), dtype=np.dtype(fields))
+    vertices['x'] = points[:, 0]
+    vertices['y'] = points[:, 1]
+    vertices['z'] = points[:, 2]
+    if colors is not None:
+        if colors.dtype != np.uint8:
+            colors = np.round(np.clip(colors, 0, 1) * 255).astype(np.uint8)
+        vertices['red'] = colors[:, 0]
+        vertices['green'] = colors[:, 1]
+        vertices['blue'] = colors[:, 2]
+
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(points)}"]
+    header += [f"property {'float' if dtype == '<f4' else 'uchar'} {name}" for name, dtype in fields]
+    header += ["end_header", ""]
+    with open(path, 'wb') as f:
+        f.write("\n".join(header).encode('ascii'))
+        vertices.tofile(f)
+
 def downsample():
     if not os.path.exists(INPUT_FILE):
         print(f"Error: Could not find {INPUT_FILE}")
@@ -20,16 +76,19 @@ def downsample():
 
     print(f"Downsampling with voxel size {VOXEL_SIZE}m...")
     # This averages all points inside a 10cm box into a single point
-    downsampled_pcd = pcd.voxel_down_sample(voxel_size=VOXEL_SIZE)
-    
-    new_count = len(downsampled_pcd.points)
+    points = np.asarray(pcd.points)
+    colors = np.asarray(pcd.colors) if pcd.has_colors() else None
+    points, colors = voxel_downsample(points, VOXEL_SIZE, colors)
+
+    new_count = len(points)
     print(f"New Points:      {new_count:,}")
     
-    reduction = (1 - (new_count / original_count)) * 100
-    print(f"Reduction:       {reduction:.1f}% removed")
+    if original_count > 0:
+        reduction = (1 - (new_count / original_count)) * 100
+        print(f"Reduction:       {reduction:.1f}% removed")
 
     print(f"Saving to {OUTPUT_FILE}...")
-    o3d.io.write_point_cloud(OUTPUT_FILE, downsampled_pcd, write_ascii=False)
+    write_ply(OUTPUT_FILE, points, colors)
     print("Done! Use this new file for training.")
 
 if __name__ == "__main__":
@@ -1,13 +1,14 @@
 import laspy
 import numpy as np
-import open3d as o3d
 import glob
 import os
+from downsample_ply import write_ply
 
 # --- CONFIGURATION ---
 INPUT_FOLDER = "aisim_ns_dataset_lidar\ego_lidar_sensor_las"   # Folder containing your .las files
 OUTPUT_FILENAME = "aisim_ns_dataset_lidar/lidar_merged.ply"
 USE_INTENSITY_AS_COLOR = True # Set to False if you want pure white points
+READ_CHUNK_SIZE = 1_000_000  # Points read per chunk, keeps memory flat for big files
 # ---------------------
 
 def get_files():
@@ -21,8 +22,18 @@ def process_lidar():
         print(f"No .las/.laz files found in {INPUT_FOLDER}")
         return
 
-    all_points = []
-    all_colors = []
+    # First pass: only read the headers so the output can be allocated once
+    total = 0
+    for filepath in files:
+        try:
+            with laspy.open(filepath) as f:
+                total += f.header.point_count
+        except Exception:
+            pass  # reported again (and skipped) in the main loop
+
+    merged_points = np.empty((total, 3), dtype=np.float64)
+    merged_colors = np.empty((total, 3), dtype=np.float32)
+    offset = 0
 
     print(f"Found {len(files)} Lidar files. Processing...")
 
@@ -36,40 +47,63 @@ def process_lidar():
                     print(f"[{i+1}/{len(files)}] Skipping {filename} (Empty: 0 points)")
                     continue
 
-                # Read the data
-                las = f.read()
-                
-                # 2. Extract XYZ
-                points = np.vstack((las.x, las.y, las.z)).transpose()
-                all_points.append(points)
-
-                # 3. Extract Color
-                if USE_INTENSITY_AS_COLOR:
-                    if hasattr(las, 'intensity') and len(las.intensity) > 0:
-                        intensity = np.array(las.intensity, dtype=np.float32)
-                        
-                        # Normalize
-                        max_val = np.percentile(intensity, 99) 
-                        if max_val > 0:
-                            intensity /= max_val
-                        intensity = np.clip(intensity, 0, 1)
-                        
-                        colors = np.stack([intensity, intensity, intensity], axis=1)
-                        all_colors.append(colors)
-                    
-                    elif hasattr(las, 'red') and len(las.red) > 0:
-                        red = np.array(las.red)
-                        green = np.array(las.green)
-                        blue = np.array(las.blue)
-                        scale = 65535.0 if np.max(red) > 255 else 255.0
-                        colors = np.vstack((red, green, blue)).transpose() / scale
-                        all_colors.append(colors)
-                    else:
-                        white = np.ones_like(points)
-                        all_colors.append(white)
+                # 2. Pick the color source from the point format
+                dims = set(f.header.point_format.dimension_names)
+                if not USE_INTENSITY_AS_COLOR:
+                    color_mode = "white"
+                elif 'intensity' in dims:
+                    color_mode = "intensity"
+                elif 'red' in dims:
+                    color_mode = "rgb"
                 else:
-                    white = np.ones_like(points)
-                    all_colors.append(white)
+                    color_mode = "white"
+
+                # 3. Stream the points in chunks straight into the merged buffers.
+                # XYZ is scaled from the raw int32 X/Y/Z ourselves instead of
+                # letting laspy build float64 copies through .x/.y/.z, colors are
+                # written raw and normalized once the whole file is in.
+                sx, sy, sz = f.header.scales
+                ox, oy, oz = f.header.offsets
+                n = 0
+                for chunk in f.chunk_iterator(READ_CHUNK_SIZE):
+                    m = len(chunk)
+                    if offset + n + m > total:
+                        raise ValueError("more points than the header reported")
+                    out_points = merged_points[offset + n:offset + n + m]
+                    out_points[:, 0] = chunk.X * sx + ox
+                    out_points[:, 1] = chunk.Y * sy + oy
+                    out_points[:, 2] = chunk.Z * sz + oz
+
+                    out_colors = merged_colors[offset + n:offset + n + m]
+                    if color_mode == "intensity":
+                        out_colors[:, 0] = chunk.intensity
+                    elif color_mode == "rgb":
+                        out_colors[:, 0] = chunk.red
+                        out_colors[:, 1] = chunk.green
+                        out_colors[:, 2] = chunk.blue
+                    n += m
+
+                # 4. Normalize the colors of this file
+                out_colors = merged_colors[offset:offset + n]
+                if n == 0:
+                    pass
+                elif color_mode == "intensity":
+                    # Scale + clip in place on the red column, then broadcast it to
+                    # green/blue in one assignment (np.percentile already uses a
+                    # partial sort, so that stays)
+                    intensity = out_colors[:, 0]
+                    max_val = np.percentile(intensity, 99)
+                    if max_val > 0:
+                        intensity /= max_val
+                    np.clip(intensity, 0, 1, out=intensity)
+                    out_colors[:, 1:] = intensity[:, None]
+                elif color_mode == "rgb":
+                    scale = 65535.0 if out_colors[:, 0].max() > 255 else 255.0
+                    out_colors /= scale
+                else:
+                    out_colors[:] = 1.0
+
+                offset += n
         
         # Only print if valid points were actually processed
             if i % 10 == 0:
@@ -80,21 +114,19 @@ def process_lidar():
 
     # --- MERGE ---
     print("Merging point clouds...")
-    if not all_points:
+    if offset == 0:
         print("Error: No valid points found in any file.")
         return
 
-    merged_points = np.vstack(all_points)
-    merged_colors = np.vstack(all_colors)
+    # Drop the tail left over by files that failed to read
+    merged_points = merged_points[:offset]
+    merged_colors = merged_colors[:offset]
 
     print(f"Total Points: {len(merged_points)}")
 
     # --- SAVE ---
     print(f"Saving to {OUTPUT_FILENAME}...")
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(merged_points)
-    pcd.colors = o3d.utility.Vector3dVector(merged_colors)
-    o3d.io.write_point_cloud(OUTPUT_FILENAME, pcd, write_ascii=False)
+    write_ply(OUTPUT_FILENAME, merged_points, merged_colors)
     
     print("Success!")
 
@@ -1,9 +1,10 @@
 import laspy
 import numpy as np
-import open3d as o3d
 import json
 import os
 import glob
+from concurrent.futures import ProcessPoolExecutor
+from downsample_ply import voxel_downsample, write_ply
 
 # --- CONFIGURATION ---
 DATASET_FOLDER = 'aisim_ns_dataset_lidar'
@@ -35,21 +36,25 @@ def load_transforms(json_path):
     frames.sort(key=lambda x: x['file_path'])
     return frames
 
+# Rotates Lidar (X-forward) to Camera (Z-back) conventions if needed
+ROTATION_FIX = np.array([
+    [0, -1, 0, 0],
+    [0, 0, 1, 0],
+    [1, 0, 0, 0],
+    [0, 0, 0, 1]
+], dtype=np.float64)
+
 def apply_matrix_transform(points, matrix):
     """
-    Applies a 4x4 transformation matrix to an array of 3D points.
+    Applies a 4x4 affine transformation matrix to an array of 3D points.
     Input: (N, 3) array, 4x4 matrix
     Output: (N, 3) array
     """
-    # Convert [x,y,z] to [x,y,z,1] (Homogeneous coordinates)
-    ones = np.ones((points.shape[0], 1))
-    points_hom = np.hstack((points, ones))
-    
-    # Multiply: (Matrix * Point_Transpose).Transpose
-    transformed_hom = (matrix @ points_hom.T).T
-    
-    # Return only [x,y,z]
-    return transformed_hom[:, :3]
+    # Rotation + translation, no homogeneous [x,y,z,1] copy needed.
+    # The translation is added in place so the matmul output is the only allocation
+    transformed = points @ matrix[:3, :3].T
+    transformed += matrix[:3, 3]
+    return transformed
 
 def process_single_frame(las_path, transform_matrix):
     """
@@ -63,48 +68,58 @@ def process_single_frame(las_path, transform_matrix):
                 return None
 
             las = f.read()
-            # 1. Get Local Points (Relative to Car)
-            local_points = np.vstack((las.x, las.y, las.z)).transpose()
+            # 1. Get Local Points (Relative to Car) as the raw int32 X/Y/Z.
+            # float64, float32 only holds integers exactly up to 2^24 (~840 m at a 5e-5 scale)
+            raw_points = np.empty((len(las.points), 3), dtype=np.float64)
+            raw_points[:, 0] = las.X
+            raw_points[:, 1] = las.Y
+            raw_points[:, 2] = las.Z
+
+            # The LAS scale/offset is just another affine in front of the pose
+            scale_offset = np.eye(4)
+            scale_offset[:3, :3] = np.diag(las.header.scales)
+            scale_offset[:3, 3] = las.header.offsets
 
             # 2. (Optional) Fix Lidar Axis Orientation
-            # Rotates Lidar (X-forward) to Camera (Z-back) conventions if needed
             if FIX_ORIENTATION:
-                rotation_fix = np.array([
-                    [0, -1, 0, 0], 
-                    [0, 0, 1, 0], 
-                    [1, 0, 0, 0], 
-                    [0, 0, 0, 1]
-                ])
-                local_points = apply_matrix_transform(local_points, rotation_fix)
-
-            # 3. Move to World Space (Local -> Global)
-            world_points = apply_matrix_transform(local_points, transform_matrix)
-            return world_points
+                transform_matrix = transform_matrix @ ROTATION_FIX
+
+            # 3. Move to World Space (Local -> Global) in a single matmul.
+            # Only the world coordinates go to float32, which also halves what is sent back to main
+            world_matrix = transform_matrix @ scale_offset
+            world_points = apply_matrix_transform(raw_points, world_matrix)
+            return world_points.astype(np.float32)
 
     except Exception as e:
         print(f"Warning: Failed to read {las_path}: {e}")
         return None
 
-def save_point_cloud(points_list, output_path):
-    """Merges, downsamples, and saves the final result."""
-    if not points_list:
+def count_points(las_files):
+    """Reads only the headers to get the total number of points."""
+    total = 0
+    for las_path in las_files:
+        try:
+            with laspy.open(las_path) as f:
+                total += f.header.point_count
+        except Exception:
+            pass  # process_single_frame warns about it
+    return total
+
+def save_point_cloud(merged_points, output_path):
+    """Downsamples and saves the merged points."""
+    if len(merged_points) == 0:
         print("Error: No points found to save.")
         return
 
-    print("Merging chunks...")
-    merged_points = np.vstack(points_list)
     print(f" -> Total Raw Points: {len(merged_points):,}")
 
     print(f"Downsampling (Voxel Size: {VOXEL_SIZE}m)...")
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(merged_points)
-    
     # Optimize: Remove duplicates to save memory
-    pcd = pcd.voxel_down_sample(voxel_size=VOXEL_SIZE)
-    print(f" -> Optimized Points: {len(pcd.points):,}")
+    points, _ = voxel_downsample(merged_points, VOXEL_SIZE)
+    print(f" -> Optimized Points: {len(points):,}")
 
     print(f"Saving to {output_path}...")
-    o3d.io.write_point_cloud(output_path, pcd, write_ascii=False)
+    write_ply(output_path, points)
     print("Success.")
 
 def main():
@@ -118,25 +133,30 @@ def main():
     count = min(len(las_files), len(frames))
     print(f"Processing {count} aligned frames...")
 
-    all_world_points = []
-
-    # 2. Process Loop
-    for i in range(count):
-        # Extract the pose matrix for this specific frame
-        matrix = np.array(frames[i]['transform_matrix'])
-        
-        # Process the file
-        points = process_single_frame(las_files[i], matrix)
-        
-        if points is not None:
-            all_world_points.append(points)
-            
-        # Progress Bar
-        if i % 50 == 0:
-            print(f"Processed {i}/{count}...")
+    # Allocate the merged cloud once and copy each frame straight into it
+    total = count_points(las_files[:count])
+    merged_points = np.empty((total, 3), dtype=np.float32)
+    offset = 0
+
+    # 2. Process Loop (one LAS file per worker, results come back in order)
+    # Extract the pose matrix for each frame up front so pickling is cheap
+    matrices = [np.array(frames[i]['transform_matrix']) for i in range(count)]
+
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(process_single_frame, las_files[:count], matrices)
+        for i, points in enumerate(results):
+            if points is not None and offset + len(points) <= total:
+                merged_points[offset:offset + len(points)] = points
+                offset += len(points)
+            elif points is not None:
+                print(f"Warning: {las_files[i]} has more points than its header, skipping")
+
+            # Progress Bar
+            if i % 50 == 0:
+                print(f"Processed {i}/{count}...")
 
     # 3. Save
-    save_point_cloud(all_world_points, OUTPUT_FILENAME)
+    save_point_cloud(merged_points[:offset], OUTPUT_FILENAME)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
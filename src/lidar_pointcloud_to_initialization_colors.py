@@ -18,6 +18,7 @@ import matplotlib.pyplot as plt
 
 from pathlib import Path
 
+from calculation_for_transformsfile import load_camera_calibration
 from calculation_for_transformsfile import get_sensor_position_rotation
 from calculation_for_transformsfile import calculate_pom_deg
 
@@ -35,7 +36,8 @@ LIDAR = "lidar_sensor"
 
 
 def get_sensor_pom(camera_calibration_file: Path, camera_type: str = CAMERA_TYPE):
-    sensor_pos, sensor_rot = get_sensor_position_rotation(camera_calibration_file, camera_type)
+    camera_calibration = load_camera_calibration(camera_calibration_file)
+    sensor_pos, sensor_rot = get_sensor_position_rotation(camera_calibration, camera_type)
     yaw, pitch, roll = sensor_rot['yaw'], sensor_rot['pitch'], sensor_rot['roll']
     T_sensor_pom = calculate_pom_deg(sensor_pos, yaw, pitch, roll)
 
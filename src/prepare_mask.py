@@ -16,7 +16,7 @@ I, for example, used this feature of nerfstudio to mask out front and back of a
 
 
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from PIL import Image
 import numpy as np
@@ -41,7 +41,10 @@ CONFIG = {
     "filename_extension": ".jpg",
     
     # Padding: Ensures '00000' (5 digits) instead of '0000' (4 digits)
-    "min_padding": 5 
+    "min_padding": 5,
+
+    # Number of threads writing the copies
+    "write_threads": 8
 }
 
 def get_resolution_from_image(filepath: str) -> tuple[int, int]:
@@ -74,19 +77,33 @@ def generate_sequence(source_file: str, destination_dir: str, count: int, prefix
     print(f"Generating {count} frames in '{destination_dir}'...")
     print(f"Format: {base_name}{'0'*pad_width}{ext}")
 
-    for i in range(count):
-        # zfill(5) turns 0 -> '00000', 10 -> '00010'
-        filename = f"{base_name}{str(i).zfill(pad_width)}{ext}"
-        dest_path = os.path.join(destination_dir, filename)
-        
-        try:
-            shutil.copy2(source_file, dest_path)
-        except OSError as e:
-            print(f"Failed to copy frame {i}: {e}")
-            break
-            
-        if i > 0 and i % (count // 10) == 0:
-            print(f" -> Progress: {i}/{count}")
+    # Every frame gets the same bytes, so read the source only once
+    with open(source_file, 'rb') as f:
+        payload = f.read()
+
+    def write_copy(dest_path):
+        with open(dest_path, 'wb') as f:
+            f.write(payload)
+
+    # zfill(5) turns 0 -> '00000', 10 -> '00010'
+    dest_paths = [
+        os.path.join(destination_dir, f"{base_name}{str(i).zfill(pad_width)}{ext}")
+        for i in range(count)
+    ]
+
+    with ThreadPoolExecutor(max_workers=CONFIG["write_threads"]) as executor:
+        futures = [executor.submit(write_copy, dest_path) for dest_path in dest_paths]
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+            except OSError as e:
+                print(f"Failed to copy frame {i}: {e}")
+                for pending in futures[i + 1:]:
+                    pending.cancel()
+                break
+
+            if i > 0 and i % (count // 10) == 0:
+                print(f" -> Progress: {i}/{count}")
 
     print(f"Completed. {count} files created.")
 
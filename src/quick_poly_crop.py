@@ -9,6 +9,11 @@ specified in the "frames" field of the transforms.json file. So this approach is
 
 
 
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
 from pathlib import Path
 import matplotlib.pyplot as plt
 from tqdm import tqdm
@@ -27,39 +32,101 @@ EDITED = "_editedjpg"
 # Choose one!
 PINHOLE_TYPE = "pinhole"
 # PINHOLE_TYPE = "pinhole_duplicate0"
-
-# edited_path = Path("pinhole_duplicate0_00000_edited.tga") # Choose this for different
-edited_path = Path(f"{PINHOLE_TYPE}_00000_edited.tga")
-edited_img = Image.open(edited_path).convert("RGBA")
-edited_array = np.array(edited_img)
-
-mask = edited_array[:, :, 3] != 0 
-
-plt.imshow(mask)
-plt.show()
-
-# input_folder = Path("ego/pinhole/color")
-
-# input_folder = Path(f"{2025-12-04_16-02-46}/ego/pinhole_duplicate0/color") # 
-# NOTE: Different folder
-
-input_folder = Path(f"{GPS_VEHICLE_SENSOR_DATASET}/ego/{PINHOLE_TYPE}/color")
-output_folder = Path(f"./{GPS_VEHICLE_SENSOR_DATASET + EDITED}/{PINHOLE_TYPE}") 
-output_folder.mkdir(exist_ok=True)
-
-# we essentially retain the same mask for the edited image for each image in the folder
-for img_path in tqdm(input_folder.glob("*.tga")):
-    img = Image.open(img_path).convert("RGBA")
-    img_array = np.array(img)
-
-    if img_array.shape != edited_array.shape:
-        raise ValueError(f"Image {img_path} has different dimensions.")
-
-    result_array = np.zeros_like(img_array)
-    result_array[mask] = img_array[mask]
-
-    result_img = Image.fromarray(result_array)
-    result_img.save(output_folder / (img_path.stem + ".jpg"))
-
-print("Batch processing complete!")
-print(f"Output saved to: {output_folder}")
+CHUNK_SIZE = 8   # images handed to a worker process at once
+SAVE_THREADS = 4 # JPG encode/save threads per worker process
+
+# Set by init_worker() once per process, so the mask is not re-pickled for every image.
+_mask_pil = None
+_edited_size = None
+_canvases = None
+
+def init_worker(mask_pil, edited_size):
+    global _mask_pil, _edited_size, _canvases
+    _mask_pil = mask_pil
+    _edited_size = edited_size
+    # A small ring of black output canvases per worker, reused for every frame. The mask is strictly 0/255,
+    # so each paste fully overwrites the masked pixels and the rest stay black.
+    # One per save thread plus the one being pasted, a canvas goes back in once its JPG is written.
+    _canvases = queue.Queue()
+    for _ in range(SAVE_THREADS + 1):
+        _canvases.put(Image.new("RGB", edited_size, (0, 0, 0)))
+
+def process(img_path):
+    img = Image.open(img_path)
+    # draft() lets decoders that support it (JPEG) decode straight to RGB; it is a no-op for TGA.
+    img.draft("RGB", img.size)
+    # Pasting RGBA onto the RGB canvas just drops alpha in C, so skip the full-frame convert("RGB") copy
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    # The real check is done once on the first image in main(); this one is stripped by python -O
+    assert img.size == _edited_size, f"Image {img_path} has different dimensions."
+
+    # Waits for a free canvas if all of them are still being saved
+    canvas = _canvases.get()
+    # PIL's masked paste does the masking in C, no NumPy round-trip needed.
+    # The output is JPG anyway, so we go straight to RGB (black outside the mask).
+    try:
+        canvas.paste(img, (0, 0), _mask_pil)
+    except Exception:
+        _canvases.put(canvas)
+        raise
+    return canvas
+
+def save_canvas(canvas, output_path):
+    """Saves a canvas from process() and hands it back to the ring."""
+    try:
+        canvas.save(output_path)
+    finally:
+        _canvases.put(canvas)
+
+def process_chunk(img_paths, output_folder):
+    """
+    Decodes and masks a chunk of images while a small thread pool encodes and saves the previous ones
+    (Pillow releases the GIL while encoding JPG). All saves are finished before returning.
+    """
+    with ThreadPoolExecutor(max_workers=SAVE_THREADS) as saver:
+        futures = [saver.submit(save_canvas, process(img_path), output_folder / (img_path.stem + ".jpg")) for img_path in img_paths]
+        for future in futures:
+            future.result() # re-raise errors from the save threads
+    return len(img_paths)
+
+def main():
+    # edited_path = Path("pinhole_duplicate0_00000_edited.tga") # Choose this for different
+    edited_path = Path(f"{PINHOLE_TYPE}_00000_edited.tga")
+    edited_img = Image.open(edited_path).convert("RGBA")
+    # Only the alpha channel matters, so work with a 2D 'L' band instead of the full HxWx4 array
+    alpha_array = np.asarray(edited_img.getchannel("A"))
+
+    mask = alpha_array != 0 
+    mask_pil = Image.fromarray(mask.astype(np.uint8) * 255, mode="L")
+
+    plt.imshow(mask)
+    plt.show()
+
+    # input_folder = Path("ego/pinhole/color")
+
+    # input_folder = Path(f"{2025-12-04_16-02-46}/ego/pinhole_duplicate0/color") # 
+    # NOTE: Different folder
+
+    input_folder = Path(f"{GPS_VEHICLE_SENSOR_DATASET}/ego/{PINHOLE_TYPE}/color")
+    output_folder = Path(f"./{GPS_VEHICLE_SENSOR_DATASET + EDITED}/{PINHOLE_TYPE}") 
+    output_folder.mkdir(exist_ok=True)
+
+    # we essentially retain the same mask for the edited image for each image in the folder
+    img_paths = list(input_folder.glob("*.tga"))
+    # All frames come from the same sensor, so checking the first one is enough
+    if img_paths:
+        with Image.open(img_paths[0]) as first_img:
+            if first_img.size != edited_img.size:
+                raise ValueError(f"Image {img_paths[0]} has different dimensions.")
+    chunks = [img_paths[i:i + CHUNK_SIZE] for i in range(0, len(img_paths), CHUNK_SIZE)]
+    with Pool(processes=os.cpu_count(), initializer=init_worker, initargs=(mask_pil, edited_img.size)) as pool:
+        with tqdm(total=len(img_paths)) as progress:
+            for done in pool.imap_unordered(partial(process_chunk, output_folder=output_folder), chunks):
+                progress.update(done)
+
+    print("Batch processing complete!")
+    print(f"Output saved to: {output_folder}")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,132 @@
 import os
+import sys
+import errno
+import ctypes
 import shutil
 import argparse
 import re
-from typing import List, Dict, Optional
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Tuple
+from tqdm import tqdm
+
+# Regex to parse: {camera_type}_{00000}.jpg
+# Captures: (camera_name), (frame_number)
+# Only used when CameraRig(use_regex=True), the default parser uses plain string ops.
+# Camera names are plain word characters, so no greedy '.+' that has to backtrack from
+# the end of the name, and fullmatch + \Z instead of '$'.
+FILENAME_PATTERN = re.compile(r"([A-Za-z_0-9]+?)_(\d{5})\.jpg\Z")
+_FULLMATCH = FILENAME_PATTERN.fullmatch  # Bound once, parse_filename runs per file
+
+# ioctl number of FICLONE from linux/fs.h (reflink the whole file)
+FICLONE = 0x40049409
+
+# Errors meaning "this filesystem / this pair of paths can't clone", so copy instead
+_CLONE_UNSUPPORTED = {errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+
+# Destination dir -> whether cloning worked there, so unsupported filesystems only fail once
+_clone_supported: Dict[str, bool] = {}
+
+@lru_cache(maxsize=None)
+def _libc():
+    return ctypes.CDLL(None, use_errno=True)
+
+def _clone_file(src: str, dst: str) -> None:
+    """Reflinks src to dst (copy-on-write clone, no data copied). Raises OSError if not possible."""
+    # Opening dst for writing would truncate src if they're the same file (copy2 refuses too)
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    if sys.platform.startswith("linux"):
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                # Don't leave the empty, truncated dst behind, whatever the error
+                os.remove(dst)
+                raise
+    elif sys.platform == "darwin":
+        # clonefile(2) refuses to overwrite, copy2 would have
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if _libc().clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+    else:
+        raise OSError(errno.ENOTSUP, "file cloning not supported on this platform", dst)
+
+def _fast_copy(src: str, dst: str) -> None:
+    """
+    Same result as shutil.copy2, but clones the file when the filesystem supports it
+    (Btrfs, XFS, APFS, ...), which is O(1) instead of copying the bytes.
+    """
+    dst_dir = os.path.dirname(dst)
+    if _clone_supported.get(dst_dir, True):
+        try:
+            _clone_file(src, dst)
+            shutil.copystat(src, dst)
+            _clone_supported[dst_dir] = True
+            return
+        except OSError as e:
+            if e.errno not in _CLONE_UNSUPPORTED:
+                raise
+            _clone_supported[dst_dir] = False
+
+    shutil.copy2(src, dst)
+
+def _is_same_entry(src: str, dst: str) -> bool:
+    """True if dst names src itself, however the two paths are spelled (symlinks, '..', case)."""
+    if os.path.normcase(os.path.basename(src)) != os.path.normcase(os.path.basename(dst)):
+        return False
+    try:
+        return os.path.samefile(os.path.dirname(src) or os.curdir, os.path.dirname(dst) or os.curdir)
+    except FileNotFoundError:
+        return False
+
+def _place_link(src: str, dst: str, make_link) -> None:
+    """
+    Links can't overwrite like copy2 does, so the link is made under a temp name next to dst
+    and renamed over it. Nothing is deleted up front, and a dst that is src itself is refused.
+    """
+    if _is_same_entry(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.link-tmp")
+    if os.path.lexists(tmp):
+        os.remove(tmp) # Left over from an interrupted run
+    make_link(tmp)
+    try:
+        os.replace(tmp, dst)
+    finally:
+        # Also when dst already was a hardlink of src, rename() is then a no-op that keeps tmp
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+def _hard_link(src: str, dst: str) -> None:
+    _place_link(src, dst, lambda path: os.link(src, path))
+
+def _soft_link(src: str, dst: str) -> None:
+    _place_link(src, dst, lambda path: os.symlink(os.path.abspath(src), path))
+
+def _reflink(src: str, dst: str) -> None:
+    """Like _fast_copy, but fails instead of falling back to a byte copy."""
+    _clone_file(src, dst)
+    shutil.copystat(src, dst)
+
+# --link mode -> function that puts src at dst
+LINK_MODES = {
+    "none": _fast_copy,     # Real copy (reflinked when the filesystem allows it)
+    "hard": _hard_link,     # Hardlink, same filesystem only, no bytes written
+    "soft": _soft_link,     # Symlink to the absolute source path
+    "reflink": _reflink,    # Copy-on-write clone, errors out where unsupported
+}
+
 
 class CameraRig:
     """
     Represents the specific 4-camera setup for the aiSim dataset.
     Handles the logic of grouping individual files into synchronized temporal frames.
     """
-    def __init__(self):
+    def __init__(self, use_regex: bool = False):
         # The specific camera prefixes defined in your convention
         self.camera_names = [
             "pinhole",
@@ -17,52 +134,97 @@ class CameraRig:
             "pinhole_duplicate1",
             "pinhole_duplicate2"
         ]
-        
-        # Regex to parse: {camera_type}_{00000}.jpg
-        # Captures: (camera_name), (frame_number)
-        self.filename_pattern = re.compile(r"(.+)_(\d{5})\.jpg$")
+        self._camera_set = frozenset(self.camera_names)
+        # Slot of every camera in a frame's list of files
+        self._camera_index = {name: i for i, name in enumerate(self.camera_names)}
+        # Bit i of a frame's mask is set once camera i has arrived, so all bits set = complete frame
+        self._complete_mask = (1 << len(self.camera_names)) - 1
+        self.use_regex = use_regex
 
     def is_valid_camera(self, name: str) -> bool:
-        return name in self.camera_names
+        return name in self._camera_set
+
+    def parse_filename(self, filename: str) -> Optional[Tuple[str, str]]:
+        """Splits '{camera_type}_{00000}.jpg' into (camera_type, '00000'), None if it doesn't fit."""
+        if self.use_regex:
+            match = _FULLMATCH(filename)
+            return match.groups() if match else None
 
-    def group_files_by_frame(self, file_list: List[str]) -> Dict[int, Dict[str, str]]:
+        if not filename.endswith(".jpg"):
+            return None
+        stem = filename[:-4]
+        idx = stem.rfind('_')
+        if idx < 1:
+            return None
+        frame_str = stem[idx + 1:]
+        # isdecimal, not isdigit: isdigit also lets through "²" and friends, which int() rejects
+        if len(frame_str) != 5 or not frame_str.isdecimal():
+            return None
+        return stem[:idx], frame_str
+
+    def group_files_by_frame(self, entries: List[os.DirEntry]) -> Tuple[Dict[int, List[Optional[os.DirEntry]]], Dict[int, int]]:
         """
-        Scans a list of filenames and groups them into atomic frames.
-        Returns: { frame_id: { 'pinhole': 'filename', 'pinhole_duplicate0': 'filename', ... } }
+        Scans a list of directory entries (from os.scandir) and groups them into atomic frames.
+        Returns: ({ frame_id: [DirEntry or None per camera, in camera_names order] },
+                  { frame_id: bitmask of the cameras present })
+        A fixed list per frame is much lighter than a dict per frame.
         """
         frames = {}
+        frame_masks = {}
+        num_cameras = len(self.camera_names)
+        camera_index = self._camera_index
+        parse = self.parse_filename  # Skip the attribute lookup per entry
 
-        for filename in file_list:
-            match = self.filename_pattern.match(filename)
-            if not match:
+        for entry in entries:
+            parsed = parse(entry.name)
+            if parsed is None:
                 continue
 
-            cam_name, frame_str = match.groups()
+            cam_name, frame_str = parsed
             frame_id = int(frame_str)
 
-            if not self.is_valid_camera(cam_name):
+            slot = camera_index.get(cam_name)
+            if slot is None:
                 continue
 
-            if frame_id not in frames:
-                frames[frame_id] = {}
+            cam_files = frames.get(frame_id)
+            if cam_files is None:
+                cam_files = frames[frame_id] = [None] * num_cameras
+                frame_masks[frame_id] = 0
             
-            frames[frame_id][cam_name] = filename
+            cam_files[slot] = entry
+            frame_masks[frame_id] |= 1 << slot
+
+        return frames, frame_masks
 
-        return frames
+    def camera_mask(self, cam_files: List[Optional[os.DirEntry]]) -> int:
+        """Bitmask of the cameras present in one frame's list of files."""
+        return sum(1 << i for i, entry in enumerate(cam_files) if entry is not None)
 
-    def filter_complete_frames(self, frames: Dict[int, Dict[str, str]]) -> Dict[int, Dict[str, str]]:
+    def filter_complete_frames(self, frames: Dict[int, List[Optional[os.DirEntry]]], frame_masks: Optional[Dict[int, int]] = None,
+                               limit: Optional[int] = None) -> Dict[int, List[os.DirEntry]]:
         """
         Optional: Validation step to ensure every frame has exactly 4 cameras.
         If a frame is missing a camera (dropped packet), we usually want to skip it.
+        Returns the complete frames sorted by frame id. With a limit, stops after
+        the first 'limit' complete frames.
+        frame_masks are the masks returned by group_files_by_frame, without them
+        they are worked out from the frames.
         """
         complete_frames = {}
-        expected_count = len(self.camera_names)
+        complete_mask = self._complete_mask
+        if frame_masks is None:
+            frame_masks = {frame_id: self.camera_mask(cam_files) for frame_id, cam_files in frames.items()}
 
-        for frame_id, cam_files in frames.items():
-            if len(cam_files) == expected_count:
-                complete_frames[frame_id] = cam_files
+        for frame_id in sorted(frames):
+            if limit is not None and len(complete_frames) >= limit:
+                break
+
+            mask = frame_masks[frame_id]
+            if mask == complete_mask:
+                complete_frames[frame_id] = frames[frame_id]
             else:
-                missing = set(self.camera_names) - set(cam_files.keys())
+                missing = {name for i, name in enumerate(self.camera_names) if not (mask >> i) & 1}
                 print(f"[Warning] Frame {frame_id} is incomplete. Missing: {missing}. Skipping.")
         
         return complete_frames
@@ -74,21 +236,37 @@ def process_dataset(args):
     if not os.path.exists(args.input_dir):
         print(f"Error: Input directory '{args.input_dir}' does not exist.")
         return
+    # Copying (or linking) a folder onto itself would clobber the source images, refuse like copy2 does
+    if os.path.exists(args.output_dir) and os.path.samefile(args.input_dir, args.output_dir):
+        raise shutil.SameFileError(f"{args.input_dir!r} and {args.output_dir!r} are the same directory")
 
     # 1. Scan Directory
     print(f"Scanning {args.input_dir}...")
-    all_files = sorted([f for f in os.listdir(args.input_dir) if f.endswith(".jpg")])
+    # os.scandir hands back DirEntry objects, so the full source path comes for free.
+    # No need to sort the names, only the frame ids are sorted (step 3).
+    with os.scandir(args.input_dir) as it:
+        all_entries = [e for e in it if e.name.endswith(".jpg")]
     
     # 2. Group into Frames
     # We work with 'Frames' (temporal moments), not raw images, to keep sync.
-    frames = rig.group_files_by_frame(all_files)
+    frames, frame_masks = rig.group_files_by_frame(all_entries)
     
     # 3. Filter for Completeness (Optional but recommended)
-    valid_frames = rig.filter_complete_frames(frames)
-    sorted_frame_ids = sorted(valid_frames.keys())
+    # With --max_images, only the first (max_frames - 1) * nth + 1 complete frames can
+    # end up selected, so don't check (or warn about) anything past them
+    needed_frames = None
+    if args.max_images is not None:
+        max_frames = args.max_images // 4
+        needed_frames = (max_frames - 1) * args.nth + 1 if max_frames > 0 else 0
+
+    valid_frames = rig.filter_complete_frames(frames, frame_masks, limit=needed_frames)
+    sorted_frame_ids = list(valid_frames.keys())
     
     total_frames_available = len(sorted_frame_ids)
-    print(f"Found {total_frames_available} complete frames ({total_frames_available * 4} images).")
+    if needed_frames is not None and total_frames_available == needed_frames:
+        print(f"Stopped after {total_frames_available} complete frames, enough for --max_images.")
+    else:
+        print(f"Found {total_frames_available} complete frames ({total_frames_available * 4} images).")
 
     # 4. Apply N-th Selection
     selected_frame_ids = sorted_frame_ids[::args.nth]
@@ -107,10 +285,10 @@ def process_dataset(args):
         
         selected_frame_ids = selected_frame_ids[:max_frames]
 
-    # Summary of job
+    # Summary of job: (source path, filename) pairs
     files_to_copy = []
     for fid in selected_frame_ids:
-        files_to_copy.extend(valid_frames[fid].values())
+        files_to_copy.extend((entry.path, entry.name) for entry in valid_frames[fid])
 
     print(f"\n--- Operation Summary ---")
     print(f"Input Directory:  {args.input_dir}")
@@ -118,6 +296,7 @@ def process_dataset(args):
     print(f"Step (N-th):      {args.nth}")
     print(f"Frames Selected:  {len(selected_frame_ids)}")
     print(f"Images to Copy:   {len(files_to_copy)}")
+    print(f"Link Mode:        {args.link}")
     print(f"-------------------------")
 
     if args.dry_run:
@@ -127,16 +306,22 @@ def process_dataset(args):
     # 6. Execute Copy
     os.makedirs(args.output_dir, exist_ok=True)
     
-    for i, filename in enumerate(files_to_copy):
-        src = os.path.join(args.input_dir, filename)
-        dst = os.path.join(args.output_dir, filename)
-        
-        shutil.copy2(src, dst)
-        
-        if i % 100 == 0:
-            print(f"Copied {i}/{len(files_to_copy)}...", end='\r')
+    # Copies are I/O bound, so run several at once to keep the disk queue busy.
+    # (_fast_copy reflinks where possible, otherwise shutil.copy2 uses os.sendfile on Linux)
+    # The link modes skip copying the bytes altogether.
+    place_file = LINK_MODES[args.link]
+    # The source paths come from scandir already, the destinations only need the prefix once
+    dst_prefix = args.output_dir.rstrip(os.sep) + os.sep
+    with ThreadPoolExecutor(max_workers=max(1, min(args.jobs, len(files_to_copy)))) as executor:
+        futures = [
+            executor.submit(place_file, src, dst_prefix + filename)
+            for src, filename in files_to_copy
+        ]
+        # disable=None turns the bar off when the output isn't a terminal (e.g. piped to a log)
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Copying", unit="img", disable=None, miniters=100):
+            future.result()
             
-    print(f"\nDone! Processed {len(files_to_copy)} images.")
+    print(f"Done! Processed {len(files_to_copy)} images.")
 
 
 if __name__ == "__main__":
@@ -147,6 +332,9 @@ if __name__ == "__main__":
     parser.add_argument("--nth", type=int, default=1, help="Take every N-th frame (e.g. 10 for 10x speedup)")
     parser.add_argument("--max_images", type=int, default=None, help="Stop after copying this many total images")
     parser.add_argument("--dry_run", action="store_true", help="Print stats without copying files")
+    parser.add_argument("--jobs", type=int, default=(os.cpu_count() or 1) * 4, help="Number of parallel copy threads")
+    parser.add_argument("--link", choices=list(LINK_MODES), default="none",
+                        help="Link instead of copying: 'hard', 'soft' or 'reflink'. Default 'none' copies the files")
 
     args = parser.parse_args()
     
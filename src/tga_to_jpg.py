@@ -3,9 +3,65 @@
 
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from PIL import Image
 
-def convert_tga_to_jpg(source_path, output_path, quality=95):
+try:
+    import simplejpeg
+except ImportError: # simplejpeg is optional, without it PIL encodes the JPEGs
+    simplejpeg = None
+
+# PIL mode -> (simplejpeg colorspace, chroma subsampling). 4:2:0 is what PIL uses at quality 95 too.
+# libjpeg-turbo reads RGBA as RGBX and just skips the alpha byte, so RGBA needs no conversion.
+SIMPLEJPEG_MODES = {
+    "RGB": ("RGB", "420"),
+    "RGBA": ("RGBA", "420"),
+    "L": ("GRAY", "Gray"),
+}
+
+def _convert_one(task):
+    """
+    Converts a single TGA file to JPG. Module level so the process pool can pickle it.
+
+    Args:
+        task (tuple): (tga_filepath, jpg_filepath, quality)
+
+    Returns:
+        str or None: An error message, or None if the file was converted.
+    """
+    tga_filepath, jpg_filepath, quality = task
+    try:
+        # Open the TGA image
+        img = Image.open(tga_filepath)
+
+        if simplejpeg is not None and img.mode in SIMPLEJPEG_MODES:
+            # libjpeg-turbo (SIMD DCT + Huffman) encodes, PIL only decodes the TGA
+            colorspace, subsampling = SIMPLEJPEG_MODES[img.mode]
+            arr = np.asarray(img)
+            if arr.ndim == 2:
+                arr = arr[:, :, None]
+            jpeg_bytes = simplejpeg.encode_jpeg(
+                arr, quality=quality, colorspace=colorspace, colorsubsampling=subsampling, fastdct=True
+            )
+            with open(jpg_filepath, 'wb') as f:
+                f.write(jpeg_bytes)
+            return None
+
+        if img.mode == "RGBA":
+            img = img.convert("RGB")
+        
+        # Save the image as JPG
+        # The 'quality' parameter controls compression, 95 is high quality.
+        # The 'optimize=True' parameter helps reduce file size slightly.
+        img.save(jpg_filepath, 'JPEG', quality=quality, optimize=True)
+        return None
+    except FileNotFoundError:
+        return f"Skipping: File not found {tga_filepath}"
+    except Exception as e:
+        return f"Error converting {os.path.basename(tga_filepath)}: {e}"
+
+def convert_tga_to_jpg(source_path, output_path, quality=95, jobs=None):
     """
     Converts TGA files from the source directory to JPG files in the output directory.
 
@@ -13,6 +69,7 @@ def convert_tga_to_jpg(source_path, output_path, quality=95):
         source_path (str): The directory containing the .tga files.
         output_path (str): The directory to save the .jpg files.
         quality (int): The JPEG compression quality (0-100).
+        jobs (int): Number of worker processes. Defaults to the number of CPUs.
     """
     if not os.path.isdir(source_path):
         print(f"Error: Source directory not found: {source_path}")
@@ -23,36 +80,25 @@ def convert_tga_to_jpg(source_path, output_path, quality=95):
     
     print(f"Starting conversion from '{source_path}' to '{output_path}'...")
     
+    # Collect all the TGA files in the source directory first
+    tasks = []
+    with os.scandir(source_path) as it:
+        for entry in it:
+            if entry.name.lower().endswith('.tga'):
+                # Create the new JPG filename by replacing the extension
+                jpg_filename = os.path.splitext(entry.name)[0] + '.jpg'
+                tasks.append((entry.path, os.path.join(output_path, jpg_filename), quality))
+
     converted_count = 0
     
-    # Walk through all files in the source directory
-    for item in os.listdir(source_path):
-        if item.lower().endswith('.tga'):
-            tga_filename = item
-            tga_filepath = os.path.join(source_path, tga_filename)
-            
-            # Create the new JPG filename by replacing the extension
-            jpg_filename = os.path.splitext(tga_filename)[0] + '.jpg'
-            jpg_filepath = os.path.join(output_path, jpg_filename)
-
-            try:
-                # Open the TGA image
-                img = Image.open(tga_filepath)
-
-                if img.mode == "RGBA":
-                    img = img.convert("RGB")
-                
-                # Save the image as JPG
-                # The 'quality' parameter controls compression, 95 is high quality.
-                # The 'optimize=True' parameter helps reduce file size slightly.
-                img.save(jpg_filepath, 'JPEG', quality=quality, optimize=True)
-                
-                print(f"  Converted: {tga_filename} -> {jpg_filename}")
+    # Decoding + encoding is CPU bound, so every file goes to its own process
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for (tga_filepath, jpg_filepath, _), error in zip(tasks, executor.map(_convert_one, tasks, chunksize=16)):
+            if error is None:
+                print(f"  Converted: {os.path.basename(tga_filepath)} -> {os.path.basename(jpg_filepath)}")
                 converted_count += 1
-            except FileNotFoundError:
-                print(f"  Skipping: File not found {tga_filepath}")
-            except Exception as e:
-                print(f"  Error converting {tga_filename}: {e}")
+            else:
+                print(f"  {error}")
 
     print(f"\nConversion complete. Total files converted: {converted_count}")
 
@@ -86,10 +132,18 @@ def main():
         help="JPEG quality setting (1-100). Default is 95."
     )
 
+    # Optional argument for the number of worker processes
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help="Number of parallel conversion processes. Default is the number of CPUs."
+    )
+
     args = parser.parse_args()
     
     # Call the conversion function with the parsed arguments
-    convert_tga_to_jpg(args.source, args.output, args.quality)
+    convert_tga_to_jpg(args.source, args.output, args.quality, args.jobs)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,25 +1,45 @@
 import open3d as o3d
 import json
+import os
 import numpy as np
+from itertools import islice
+
+try:
+    import ijson
+except ImportError: # ijson is optional, without it the whole JSON is loaded with json.load
+    ijson = None
 
 # --- CONFIGURATION ---
 PLY_FILE = "lidar_world_aligned.ply"
 JSON_FILE = "transforms.json"
 FRUSTUM_SCALE = 1.0  # Size of the camera pyramid in the viewer
 SKIP_FRAMES = 10     # Only draw every Nth frame to avoid clutter
+
+# Frustum color per camera name ({camera_type}_{00000}.jpg), anything else is yellow
+COLOR_MAP = {
+    "pinhole_duplicate0": [1, 0, 0], # Red (Right?)
+    "pinhole_duplicate1": [0, 1, 0], # Green (Back?)
+    "pinhole_duplicate2": [0, 0, 1], # Blue (Left?)
+    "pinhole": [1, 1, 0],            # Yellow (Front/Center)
+}
+DEFAULT_COLOR = [1, 1, 0]
 # ---------------------
 
-def get_camera_frustum(img_w, img_h, K, W2C, color=[1, 0, 0], scale=1.0):
+# Frustum lines between its 5 points (center, BL, BR, TR, TL)
+FRUSTUM_LINES = np.array([
+    [0, 1], [0, 2], [0, 3], [0, 4], # Center to corners
+    [1, 2], [2, 3], [3, 4], [4, 1]  # Image plane rectangle
+], dtype=np.int32)
+
+def get_frustum_corners_cam(img_w, img_h, K_inv, scale=1.0):
     """
-    Creates a line set representing the camera frustum (pyramid).
+    Image plane corners in Camera Space as a 4x4 homogeneous matrix (one corner per column).
+    Same for every camera with these intrinsics, so compute it once.
     """
     # 1. Define Camera center and Image Plane corners in Camera Space
     # Nerfstudio/OpenGL Convention: -Z is forward, +Y is up.
     # We draw the frustum pointing along -Z.
     
-    # Inverse Intrinsics to unproject pixels
-    K_inv = np.linalg.inv(K)
-    
     # Corners of the image plane at Z=1 (Normalized Device Coordinates)
     # BL, BR, TR, TL
     corners_pix = np.array([
@@ -36,42 +56,86 @@ def get_camera_frustum(img_w, img_h, K, W2C, color=[1, 0, 0], scale=1.0):
     corners_cam = corners_cam * scale
     
     # Make them 4D (homogenous)
-    corners_cam = np.vstack((corners_cam, np.ones((1, 4)))) # 4x4
-    center_cam = np.array([[0], [0], [0], [1]])             # 4x1
-    
-    # 2. Transform to World Space (using C2W matrix)
-    # Note: JSON usually provides C2W directly.
-    # If W2C was passed, invert it. Here we assume input is C2W.
-    C2W = W2C 
+    return np.vstack((corners_cam, np.ones((1, 4)))) # 4x4
+
+def get_camera_frustums(corners_cam, C2Ws):
+    """
+    Computes the frustum (pyramid) points of all cameras at once.
+    corners_cam: 4x4 from get_frustum_corners_cam, C2Ws: (N, 4, 4) Camera-to-World matrices.
+    Returns (N, 5, 3): camera center followed by the BL, BR, TR, TL image plane corners.
+    """
+    # 2. Transform to World Space (using the C2W matrices), all cameras in one einsum
+    corners_world = np.einsum('nij,jk->nik', C2Ws, corners_cam)[:, :3, :].transpose(0, 2, 1)  # Nx4x3
+    # The camera center (0, 0, 0, 1) just lands on the translation
+    centers_world = C2Ws[:, :3, 3]                                                            # Nx3
     
-    corners_world = (C2W @ corners_cam)[:3, :].T  # 4x3
-    center_world = (C2W @ center_cam)[:3, 0]      # 1x3
+    return np.concatenate((centers_world[:, None, :], corners_world), axis=1)  # Nx5x3
+
+def frustums_line_set(frustum_points, colors):
+    """
+    Creates ONE line set with all camera frustums (pyramids) from their points,
+    so the viewer only has a single object to upload and draw.
+    frustum_points: (N, 5, 3), colors: (N, 3) one color per frustum.
+    """
+    num_frustums = len(frustum_points)
     
     # 3. Create Lines (Connect center to corners, and corners to each other)
-    points = np.vstack((center_world, corners_world)) # 5 points total
-    
-    lines = [
-        [0, 1], [0, 2], [0, 3], [0, 4], # Center to corners
-        [1, 2], [2, 3], [3, 4], [4, 1]  # Image plane rectangle
-    ]
+    # Every frustum has 5 points, so frustum i's lines are offset by 5 * i
+    all_lines = (FRUSTUM_LINES[None, :, :] + 5 * np.arange(num_frustums, dtype=np.int32)[:, None, None]).reshape(-1, 2)
+    all_colors = np.repeat(np.asarray(colors, dtype=np.float64), len(FRUSTUM_LINES), axis=0)
     
     line_set = o3d.geometry.LineSet()
-    line_set.points = o3d.utility.Vector3dVector(points)
-    line_set.lines = o3d.utility.Vector2iVector(lines)
-    line_set.colors = o3d.utility.Vector3dVector([color for _ in range(len(lines))])
+    line_set.points = o3d.utility.Vector3dVector(frustum_points.reshape(-1, 3))
+    line_set.lines = o3d.utility.Vector2iVector(all_lines)
+    line_set.colors = o3d.utility.Vector3dVector(all_colors)
     
     return line_set
 
+INTRINSIC_KEYS = ('fl_x', 'fl_y', 'cx', 'cy', 'w', 'h')
+
+def load_frames(json_path, step):
+    """
+    Returns (intrinsics, every step-th frame) of a transforms.json.
+    With ijson the frames are streamed, so only the selected ones are kept in memory.
+    """
+    if ijson is None:
+        with open(json_path, 'r') as f:
+            meta = json.load(f)
+        return {k: meta[k] for k in INTRINSIC_KEYS if k in meta}, meta['frames'][::step]
+
+    with open(json_path, 'rb') as f:
+        # The intrinsics are top level numbers, usually written before the frames,
+        # so stop parsing as soon as all of them were seen
+        intrinsics = {}
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix in INTRINSIC_KEYS and event == 'number':
+                intrinsics[prefix] = value
+                if len(intrinsics) == len(INTRINSIC_KEYS):
+                    break
+
+        f.seek(0)
+        frames = list(islice(ijson.items(f, 'frames.item', use_float=True), 0, None, step))
+    return intrinsics, frames
+
+def axes_line_set(size=1.0):
+    """
+    X/Y/Z axes at the origin as 3 colored lines (X red, Y green, Z blue, like Open3D's
+    coordinate frame) instead of a full TriangleMesh with cylinders and cones.
+    """
+    axes = o3d.geometry.LineSet()
+    axes.points = o3d.utility.Vector3dVector([[0, 0, 0], [size, 0, 0], [0, size, 0], [0, 0, size]])
+    axes.lines = o3d.utility.Vector2iVector([[0, 1], [0, 2], [0, 3]])
+    axes.colors = o3d.utility.Vector3dVector([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    return axes
+
 def main():
     # 1. Load Point Cloud
     print(f"Loading {PLY_FILE}...")
     pcd = o3d.io.read_point_cloud(PLY_FILE)
     
-    # 2. Load JSON
-    with open(JSON_FILE, 'r') as f:
-        meta = json.load(f)
+    # 2. Load JSON (only every SKIP_FRAMES-th frame is kept)
+    meta, selected = load_frames(JSON_FILE, SKIP_FRAMES)
         
-    frames = meta['frames']
     fl_x = meta.get('fl_x', 500)
     fl_y = meta.get('fl_y', 500)
     cx = meta.get('cx', 320)
@@ -85,33 +149,30 @@ def main():
         [0, fl_y, cy],
         [0, 0, 1]
     ])
+    # Inverse Intrinsics to unproject pixels, and the image plane corners they give.
+    # All frames share them, so they're only computed once
+    K_inv = np.linalg.inv(K)
+    corners_cam = get_frustum_corners_cam(w, h, K_inv, scale=FRUSTUM_SCALE)
 
     geometries = [pcd]
     
-    print(f"Generating frustums for {len(frames)} frames...")
+    print(f"Generating frustums for {len(selected)} frames...")
     
     # 3. Create Frustums
-    for i in range(0, len(frames), SKIP_FRAMES):
-        frame = frames[i]
-        c2w = np.array(frame['transform_matrix'])
-        
-        # Color code based on camera name
-        fname = frame['file_path']
-        if "pinhole_duplicate0" in fname:
-            col = [1, 0, 0] # Red (Right?)
-        elif "pinhole_duplicate1" in fname:
-            col = [0, 1, 0] # Green (Back?)
-        elif "pinhole_duplicate2" in fname:
-            col = [0, 0, 1] # Blue (Left?)
-        else:
-            col = [1, 1, 0] # Yellow (Front/Center)
-            
-        frustum = get_camera_frustum(w, h, K, c2w, color=col, scale=FRUSTUM_SCALE)
-        geometries.append(frustum)
+    # JSON provides C2W directly, stack the selected ones and transform them all in one go
+    C2Ws = np.array([frame['transform_matrix'] for frame in selected], dtype=np.float64).reshape(-1, 4, 4)
+    frustum_points = get_camera_frustums(corners_cam, C2Ws)
+
+    # Color code based on camera name
+    colors = [
+        COLOR_MAP.get(os.path.basename(frame['file_path']).rsplit('_', 1)[0], DEFAULT_COLOR)
+        for frame in selected
+    ]
+    colors = np.array(colors, dtype=np.float64).reshape(-1, 3)
+    geometries.append(frustums_line_set(frustum_points, colors))
 
     # 4. Add Coordinate Frame (Origin)
-    axes = o3d.geometry.TriangleMesh.create_coordinate_frame(size=2.0, origin=[0,0,0])
-    geometries.append(axes)
+    geometries.append(axes_line_set(size=2.0))
 
     print("Visualizing... (Mouse to rotate)")
     o3d.visualization.draw_geometries(geometries)